@@ -23,63 +23,48 @@
 
 import numpy as np
 
-# set a seed for reproducibility
-np.random.seed(1234)
+# create a random number generator, with a seed for reproducibility
+rng = np.random.default_rng(1234)
 
 
 # In[60]:
 
-# generate 1000 random numbers (between 0 and 1) for each model, representing 1000 observations
-mod1 = np.random.rand(1000)
-mod2 = np.random.rand(1000)
-mod3 = np.random.rand(1000)
-mod4 = np.random.rand(1000)
-mod5 = np.random.rand(1000)
+# generate 1000 random numbers (between 0 and 1) for each of the five models, representing 1000 observations
+mods = rng.random((5, 1000))
 
 
 # In[61]:
 
 # each model independently predicts 1 (the "correct response") if random number was at least 0.3
-preds1 = np.where(mod1 > 0.3, 1, 0)
-preds2 = np.where(mod2 > 0.3, 1, 0)
-preds3 = np.where(mod3 > 0.3, 1, 0)
-preds4 = np.where(mod4 > 0.3, 1, 0)
-preds5 = np.where(mod5 > 0.3, 1, 0)
+preds = mods > 0.3
 
 
 # In[62]:
 
-# print the first 20 predictions from each model
-print preds1[:20]
-print preds2[:20]
-print preds3[:20]
-print preds4[:20]
-print preds5[:20]
+# print the first 20 predictions from each model (one row per model)
+print(preds[:, :20].astype(np.int8))
 
 
 # In[63]:
 
-# average the predictions and then round to 0 or 1
-ensemble_preds = np.round((preds1 + preds2 + preds3 + preds4 + preds5)/5.0).astype(int)
+# count the votes for each observation and predict 1 if at least 3 of the 5 models predicted 1
+ensemble_preds = (preds.sum(axis=0, dtype=np.int8) >= 3).view(np.int8)
 
 # print the ensemble's first 20 predictions
-print ensemble_preds[:20]
+print(ensemble_preds[:20])
 
 
 # In[64]:
 
 # how accurate was each individual model?
-print preds1.mean()
-print preds2.mean()
-print preds3.mean()
-print preds4.mean()
-print preds5.mean()
+individual_acc = preds.mean(axis=1)
+print(individual_acc)
 
 
 # In[65]:
 
 # how accurate was the ensemble?
-print ensemble_preds.mean()
+print(ensemble_preds.mean())
 
 
 # **Ensemble learning (or "ensembling")** is the process of combining several predictive models in order to produce a combined model that is more accurate than any individual model.
@@ -128,15 +113,15 @@ print ensemble_preds.mean()
 
 # In[66]:
 
-# set a seed for reproducibility
-np.random.seed(1)
+# create a random number generator, with a seed for reproducibility
+rng = np.random.default_rng(1)
 
 # create an array of 1 through 20
 nums = np.arange(1, 21)
-print nums
+print(nums)
 
 # sample that array 20 times with replacement
-print np.random.choice(a=nums, size=20, replace=True)
+print(rng.choice(nums, size=20, replace=True))
 
 
 # **How does bagging work (for decision trees)?**
@@ -173,11 +158,13 @@ train
 
 # In[68]:
 
-# set a seed for reproducibility
-np.random.seed(123)
+# create a random number generator, with a seed for reproducibility
+rng = np.random.default_rng(123)
 
-# create ten bootstrap samples (will be used to select rows from the DataFrame)
-samples = [np.random.choice(a=14, size=14, replace=True) for _ in range(1, 11)]
+# create ten bootstrap samples, one per row, each the same size as the training data
+# (stored as a single array of row indices, which will be used to select rows from the DataFrame)
+n_obs = len(train)
+samples = rng.integers(0, n_obs, size=(10, n_obs), dtype=np.intp)
 samples
 
 
@@ -199,27 +186,29 @@ test
 # In[71]:
 
 from sklearn.tree import DecisionTreeRegressor
+from joblib import Parallel, delayed
 
-# grow each tree deep
-treereg = DecisionTreeRegressor(max_depth=None, random_state=123)
-
-# list for storing predicted price from each tree
-predictions = []
-
-# define testing data
-X_test = test.iloc[:, 1:]
+# convert the training and testing data to NumPy arrays once, rather than once per tree
+# (features as contiguous float32, the dtype trees are fitted with, so they don't have to be copied for every tree)
+X_all = np.ascontiguousarray(train.iloc[:, 1:].to_numpy(dtype=np.float32))
+y_all = train.iloc[:, 0].to_numpy()
+X_test_np = np.ascontiguousarray(test.iloc[:, 1:].to_numpy(dtype=np.float32))
 y_test = test.iloc[:, 0]
 
-# grow one tree for each bootstrap sample and make predictions on testing data
-for sample in samples:
-    X_train = train.iloc[sample, 1:]
-    y_train = train.iloc[sample, 0]
-    treereg.fit(X_train, y_train)
-    y_pred = treereg.predict(X_test)
-    predictions.append(y_pred)
+# grow a deep tree on one bootstrap sample
+def fit_one(sample):
+    treereg = DecisionTreeRegressor(max_depth=None, random_state=123)
+    return treereg.fit(X_all[sample], y_all[sample])
+
+# the trees are independent, so grow them in parallel threads (unless there are too few to be worth it)
+n_jobs = -1 if len(samples) >= 3 else 1
+trees = Parallel(n_jobs=n_jobs, prefer='threads')(delayed(fit_one)(sample) for sample in samples)
 
-# convert predictions from list to NumPy array
-predictions = np.array(predictions)
+# make predictions on testing data with each tree, storing them in one row per tree
+# (X_test_np is already float32, the dtype trees predict with, so there is no need to check it every time)
+predictions = np.empty((len(trees), X_test_np.shape[0]))
+for i, tree in enumerate(trees):
+    predictions[i] = tree.predict(X_test_np, check_input=False)
 predictions
 
 
@@ -231,28 +220,33 @@ np.mean(predictions, axis=0)
 
 # In[73]:
 
+# define a function that calculates RMSE (the dot product of the errors with themselves is their sum of squares)
+def rmse(y_true, y_pred):
+    errors = np.asarray(y_true) - y_pred
+    return np.sqrt(np.dot(errors, errors) / errors.size)
+
 # calculate RMSE
-from sklearn import metrics
 y_pred = np.mean(predictions, axis=0)
-np.sqrt(metrics.mean_squared_error(y_test, y_pred))
+rmse(y_test, y_pred)
 
 
 # ## Bagged decision trees in scikit-learn (with *b*=500)
 
 # In[74]:
 
-# define the training and testing sets
-X_train = train.iloc[:, 1:]
-y_train = train.iloc[:, 0]
-X_test = test.iloc[:, 1:]
+# define the training and testing sets (reusing the float32 feature arrays from above)
+X_train = X_all
+y_train = y_all
+X_test = X_test_np
 y_test = test.iloc[:, 0]
 
 
 # In[75]:
 
-# instruct BaggingRegressor to use DecisionTreeRegressor as the "base estimator"
-from sklearn.ensemble import BaggingRegressor
-bagreg = BaggingRegressor(DecisionTreeRegressor(), n_estimators=500, bootstrap=True, oob_score=True, random_state=1)
+# a RandomForestRegressor that considers every feature at each split (max_features=None) is bagged decision trees,
+# and it grows and predicts with its trees in parallel (n_jobs=-1)
+from sklearn.ensemble import RandomForestRegressor
+bagreg = RandomForestRegressor(n_estimators=500, max_features=None, bootstrap=True, oob_score=True, n_jobs=-1, random_state=1)
 
 
 # In[76]:
@@ -266,7 +260,7 @@ y_pred
 # In[77]:
 
 # calculate RMSE
-np.sqrt(metrics.mean_squared_error(y_test, y_pred))
+rmse(y_test, y_pred)
 
 
 # ## Estimating out-of-sample error
@@ -283,16 +277,23 @@ samples[0]
 
 # In[79]:
 
+# mark the "in-bag" observations for each sample (one row per sample, one column per observation)
+inbag = np.zeros(samples.shape, dtype=bool)
+np.put_along_axis(inbag, samples, True, axis=1)
+
+# every observation that is not in-bag is "out-of-bag"
+oob = ~inbag
+
 # show the "in-bag" observations for each sample
-for sample in samples:
-    print set(sample)
+for row in inbag:
+    print(np.flatnonzero(row))
 
 
 # In[80]:
 
 # show the "out-of-bag" observations for each sample
-for sample in samples:
-    print sorted(set(range(14)) - set(sample))
+for row in oob:
+    print(np.flatnonzero(row))
 
 
 # How to calculate **"out-of-bag error":**
@@ -302,6 +303,20 @@ for sample in samples:
 # 
 # When *b* is sufficiently large, the **out-of-bag error** is an accurate estimate of **out-of-sample error**.
 
+# In[ ]:
+
+# predict every training observation using each of the ten trees (one row per tree)
+train_preds = np.array([tree.predict(X_all, check_input=False) for tree in trees])
+
+# average each observation's predictions over only the trees in which it was out-of-bag
+# (skipping any observation that was in-bag for every tree)
+seen = oob.any(axis=0)
+oob_preds = (train_preds * oob).sum(axis=0)[seen] / oob.sum(axis=0)[seen]
+
+# compute the out-of-bag RMSE for b=10
+rmse(y_all[seen], oob_preds)
+
+
 # In[81]:
 
 # compute the out-of-bag R-squared score (not MSE, unfortunately!) for b=500
@@ -375,10 +390,12 @@ pd.factorize(hitters.League)
 
 # In[87]:
 
-# convert to dummy variables
-hitters['League'] = pd.factorize(hitters.League)[0]
-hitters['Division'] = pd.factorize(hitters.Division)[0]
-hitters['NewLeague'] = pd.factorize(hitters.NewLeague)[0]
+# convert to dummy variables (encoding all three columns in one pass, as 1-byte integers)
+# listing each column's categories in order of appearance gives the same codes as factorize
+from sklearn.preprocessing import OrdinalEncoder
+cols = ['League', 'Division', 'NewLeague']
+categories = [hitters[col].unique() for col in cols]
+hitters[cols] = OrdinalEncoder(categories=categories, dtype=np.int8).fit_transform(hitters[cols])
 hitters.head()
 
 
@@ -398,21 +415,20 @@ hitters.plot(kind='scatter', x='Years', y='Hits', c='Salary', colormap='jet', xl
 
 # In[90]:
 
-# exclude columns which represent career statistics
-feature_cols = hitters.columns[hitters.columns.str.startswith('C') == False]
-
-
-# In[91]:
-
-# exclude the response
-feature_cols = feature_cols.drop('Salary')
+# exclude columns which represent career statistics, and exclude the response
+feature_cols = hitters.columns[~hitters.columns.str.startswith('C')].drop('Salary')
 
 
 # In[92]:
 
-# define X and y
-X = hitters[feature_cols]
-y = hitters.Salary
+# define X and y (as contiguous NumPy arrays, so they are only converted once)
+X = np.ascontiguousarray(hitters[feature_cols].to_numpy(dtype=np.float32))
+y = hitters.Salary.to_numpy()
+
+# compute the cross-validation folds once, and reuse them for every model below
+from sklearn.model_selection import KFold
+cv5 = list(KFold(n_splits=5).split(X))
+cv10 = list(KFold(n_splits=10).split(X))
 
 
 # ## Predicting salary with a decision tree
@@ -424,15 +440,16 @@ y = hitters.Salary
 # list of values to try for max_depth
 max_depth_range = range(1, 21)
 
-# list to store the average RMSE for each value of max_depth
-RMSE_scores = []
+# use 10-fold cross-validation with each value of max_depth, running all of the fits in parallel
+# (tree fitting releases the GIL, so threads work well and the data doesn't have to be copied to other processes)
+from sklearn.model_selection import GridSearchCV
+from joblib import parallel_backend
+grid = GridSearchCV(DecisionTreeRegressor(random_state=1), {'max_depth': list(max_depth_range)}, cv=cv10, scoring='neg_root_mean_squared_error', refit=False, n_jobs=-1)
+with parallel_backend('threading'):
+    grid.fit(X, y)
 
-# use 10-fold cross-validation with each value of max_depth
-from sklearn.cross_validation import cross_val_score
-for depth in max_depth_range:
-    treereg = DecisionTreeRegressor(max_depth=depth, random_state=1)
-    MSE_scores = cross_val_score(treereg, X, y, cv=10, scoring='mean_squared_error')
-    RMSE_scores.append(np.mean(np.sqrt(-MSE_scores)))
+# average RMSE (across the folds) for each value of max_depth
+RMSE_scores = -grid.cv_results_['mean_test_score']
 
 
 # In[94]:
@@ -468,7 +485,7 @@ pd.DataFrame({'feature':feature_cols, 'importance':treereg.feature_importances_}
 # In[98]:
 
 from sklearn.ensemble import RandomForestRegressor
-rfreg = RandomForestRegressor()
+rfreg = RandomForestRegressor(n_jobs=-1)
 rfreg
 
 
@@ -479,14 +496,18 @@ rfreg
 # list of values to try for n_estimators
 estimator_range = range(10, 310, 10)
 
-# list to store the average RMSE for each value of n_estimators
-RMSE_scores = []
+# with a fixed random_state, the first n trees of a larger forest are exactly the forest grown with n_estimators=n,
+# so fit one forest of the largest size per fold and score every value of n_estimators from its trees
+RMSE_scores = np.zeros(len(estimator_range))
+n_trees = np.array(estimator_range)
 
 # use 5-fold cross-validation with each value of n_estimators
-for estimator in estimator_range:
-    rfreg = RandomForestRegressor(n_estimators=estimator, random_state=1)
-    MSE_scores = cross_val_score(rfreg, X, y, cv=5, scoring='mean_squared_error')
-    RMSE_scores.append(np.mean(np.sqrt(-MSE_scores)))
+for train_idx, test_idx in cv5:
+    rfreg = RandomForestRegressor(n_estimators=n_trees[-1], random_state=1, n_jobs=-1)
+    rfreg.fit(X[train_idx], y[train_idx])
+    tree_preds = np.array([tree.predict(X[test_idx]) for tree in rfreg.estimators_])
+    forest_preds = np.cumsum(tree_preds, axis=0)[n_trees - 1] / n_trees[:, np.newaxis]
+    RMSE_scores += np.sqrt(np.mean((forest_preds - y[test_idx])**2, axis=1)) / len(cv5)
 
 
 # In[100]:
@@ -506,14 +527,14 @@ plt.ylabel('RMSE (lower is better)')
 # list of values to try for max_features
 feature_range = range(1, len(feature_cols)+1)
 
-# list to store the average RMSE for each value of max_features
-RMSE_scores = []
+# use 10-fold cross-validation with each value of max_features, running all of the fits in parallel threads
+# (each forest grows its trees with n_jobs=1, since a forest with n_jobs=-1 would start a full set of threads of its own)
+grid = GridSearchCV(RandomForestRegressor(n_estimators=150, random_state=1, n_jobs=1), {'max_features': list(feature_range)}, cv=cv10, scoring='neg_root_mean_squared_error', refit=False, n_jobs=-1)
+with parallel_backend('threading'):
+    grid.fit(X, y)
 
-# use 10-fold cross-validation with each value of max_features
-for feature in feature_range:
-    rfreg = RandomForestRegressor(n_estimators=150, max_features=feature, random_state=1)
-    MSE_scores = cross_val_score(rfreg, X, y, cv=10, scoring='mean_squared_error')
-    RMSE_scores.append(np.mean(np.sqrt(-MSE_scores)))
+# average RMSE (across the folds) for each value of max_features
+RMSE_scores = -grid.cv_results_['mean_test_score']
 
 
 # In[102]:
@@ -533,7 +554,7 @@ sorted(zip(RMSE_scores, feature_range))[0]
 # In[104]:
 
 # max_features=8 was best, so fit a Random Forest using that parameter
-rfreg = RandomForestRegressor(n_estimators=150, max_features=8, oob_score=True, random_state=1)
+rfreg = RandomForestRegressor(n_estimators=150, max_features=8, oob_score=True, random_state=1, n_jobs=-1)
 rfreg.fit(X, y)
 
 
@@ -549,18 +570,32 @@ pd.DataFrame({'feature':feature_cols, 'importance':rfreg.feature_importances_}).
 rfreg.oob_score_
 
 
+# **Extremely Randomized Trees** go one step further: instead of searching for the best split point for each candidate feature, a split point is **chosen at random**, which makes the trees much faster to grow.
+
+# In[ ]:
+
+# fit Extra Trees with the same parameters, and compute the out-of-bag R-squared score
+from sklearn.ensemble import ExtraTreesRegressor
+etreg = ExtraTreesRegressor(n_estimators=150, max_features=8, bootstrap=True, oob_score=True, random_state=1, n_jobs=-1)
+etreg.fit(X, y)
+etreg.oob_score_
+
+
 # In[107]:
 
 # check the RMSE for a Random Forest
-scores = cross_val_score(rfreg, X, y, cv=10, scoring='mean_squared_error')
-np.mean(np.sqrt(-scores))
+from sklearn.model_selection import cross_val_score
+scores = cross_val_score(rfreg, X, y, cv=cv10, scoring='neg_root_mean_squared_error')
+rfreg_RMSE = -np.mean(scores)
+rfreg_RMSE
 
 
 # In[108]:
 
 # check the RMSE for a Decision Tree
-scores = cross_val_score(treereg, X, y, cv=10, scoring='mean_squared_error')
-np.mean(np.sqrt(-scores))
+scores = cross_val_score(treereg, X, y, cv=cv10, scoring='neg_root_mean_squared_error')
+treereg_RMSE = -np.mean(scores)
+treereg_RMSE
 
 
 # ## Reduce X to its most important features
@@ -573,38 +608,38 @@ X.shape
 
 # In[110]:
 
-# set a threshold for which features to include
-print rfreg.transform(X, threshold=0.1).shape
-print rfreg.transform(X, threshold='mean').shape
-print rfreg.transform(X, threshold='median').shape
+# set a threshold for which features to include (keeping the columns whose importance is at least the threshold)
+importances = rfreg.feature_importances_
+print(X[:, importances >= 0.1].shape)
+print(X[:, importances >= importances.mean()].shape)
+print(X[:, importances >= np.median(importances)].shape)
 
 
 # In[111]:
 
 # create a new feature matrix that only include important features
-X_important = rfreg.transform(X, threshold='mean')
+X_important = X[:, importances >= importances.mean()]
 
 
 # In[112]:
 
-# check the RMSE for a Random Forest that only uses important features
-rfreg = RandomForestRegressor(n_estimators=150, max_features=3, random_state=1)
-scores = cross_val_score(rfreg, X_important, y, cv=10, scoring='mean_squared_error')
-np.mean(np.sqrt(-scores))
+# check the RMSE for a Random Forest that only uses important features (using the same folds as above)
+rfreg_important = RandomForestRegressor(n_estimators=150, max_features=3, random_state=1, n_jobs=-1)
+scores = cross_val_score(rfreg_important, X_important, y, cv=cv10, scoring='neg_root_mean_squared_error')
+-np.mean(scores)
 
 
 # In[113]:
 
-# check the RMSE for a Random Forest
-scores = cross_val_score(rfreg, X, y, cv=10, scoring='mean_squared_error')
-np.mean(np.sqrt(-scores))
+# compare with the cross-validated RMSE for the tuned Random Forest (max_features=8) that uses all features,
+# which was computed above on the same folds
+rfreg_RMSE
 
 
 # In[114]:
 
-# check the RMSE for a Decision Tree
-scores = cross_val_score(treereg, X, y, cv=10, scoring='mean_squared_error')
-np.mean(np.sqrt(-scores))
+# compare with the cross-validated RMSE for a Decision Tree (computed above)
+treereg_RMSE
 
 
 # # Part 5: Boosting